@@ -0,0 +1,53 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+class DatasetCache:
+    """
+    In-process LRU cache with TTL for serialized dataset listings.
+    Entries are keyed by dataset so writes can invalidate them wholesale.
+    Writes are only seen by the process that made them, so the cache is
+    disabled when several web workers serve the same database.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 256, enabled: bool = True):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, dataset: str, key: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get((dataset, key))
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[(dataset, key)]
+            return None
+
+        self._entries.move_to_end((dataset, key))
+        return value
+
+    def set(self, dataset: str, key: Hashable, value: Any):
+        if not self.enabled:
+            return
+
+        now = time.monotonic()
+        for entry_key in [k for k, (expires_at, _) in self._entries.items() if expires_at < now]:
+            del self._entries[entry_key]
+
+        self._entries[(dataset, key)] = (now + self.ttl_seconds, value)
+        self._entries.move_to_end((dataset, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *datasets: str):
+        for entry_key in [k for k in self._entries if k[0] in datasets]:
+            del self._entries[entry_key]
+
+dataset_cache = DatasetCache(enabled=int(os.getenv("WEB_CONCURRENCY", "1")) <= 1)
@@ -1,18 +1,36 @@
 from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./rake_formation.db")
 
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg"
+}
+
+def _async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+
+QUERY_CACHE_SIZE = 1200
+
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
-    echo=False
+    echo=False,
+    query_cache_size=QUERY_CACHE_SIZE
 )
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False, query_cache_size=QUERY_CACHE_SIZE)
+
 if "sqlite" in DATABASE_URL:
     @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
     def set_sqlite_pragma(dbapi_conn, connection_record):
         cursor = dbapi_conn.cursor()
         cursor.execute("PRAGMA foreign_keys=ON")
@@ -20,14 +38,20 @@ if "sqlite" in DATABASE_URL:
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 def init_db():
+    from .migrations import upgrade_schema
+
     Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+def dispose_inherited_connections():
+    """Drop pooled connections copied from the parent into a forked worker."""
+    engine.dispose(close=False)
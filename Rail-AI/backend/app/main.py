@@ -1,21 +1,22 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from .database import init_db
+from fastapi.responses import ORJSONResponse
+from .database import init_db, dispose_inherited_connections
+from .middleware import AllowAllCORSMiddleware
 from .routers import data, planning
+from .routers.planning import planner_worker
 
 app = FastAPI(
     title="Rake Formation Decision Support System",
     description="API for railway rake formation planning and optimization",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(AllowAllCORSMiddleware)
 
 app.include_router(data.router)
 app.include_router(planning.router)
@@ -23,6 +24,25 @@ app.include_router(planning.router)
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    # Every web worker has its own pool; share the CPUs between them
+    planner_processes = max(1, os.cpu_count() // int(os.getenv("WEB_CONCURRENCY", "1")))
+    app.state.create_planner_pool = partial(
+        ProcessPoolExecutor,
+        max_workers=planner_processes,
+        initializer=dispose_inherited_connections
+    )
+    app.state.planner_pool = app.state.create_planner_pool()
+    app.state.planner_queue = asyncio.Queue(maxsize=1024)
+    app.state.planner_workers = [
+        asyncio.create_task(planner_worker(app.state))
+        for _ in range(planner_processes)
+    ]
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for worker in app.state.planner_workers:
+        worker.cancel()
+    app.state.planner_pool.shutdown(wait=False, cancel_futures=True)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,111 @@
+"""
+Additive schema upgrades for databases created before a model change.
+
+create_all only creates missing tables, so columns and indexes added to
+existing models are brought in here. Every step checks the live schema
+first and is safe to run on each startup.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+import orjson
+from .database import Base
+from .models.models import encode_plan_data
+
+
+def _convert_uuid_columns(conn: Connection):
+    """
+    Convert VARCHAR id and foreign key columns to the UUID type the models declare.
+    Foreign keys between converted columns are dropped and re-added around the change.
+    """
+    if conn.dialect.name != 'postgresql':
+        return
+
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    to_convert = {}
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        db_types = {c['name']: c['type'].compile(dialect=conn.dialect) for c in inspector.get_columns(table.name)}
+        columns = [
+            column.name for column in table.columns
+            if column.name in db_types
+            and column.type.compile(dialect=conn.dialect) == 'UUID'
+            and db_types[column.name] != 'UUID'
+        ]
+        if columns:
+            to_convert[table.name] = columns
+
+    if not to_convert:
+        return
+
+    foreign_keys = [
+        (table_name, fk)
+        for table_name in existing_tables
+        for fk in inspector.get_foreign_keys(table_name)
+        if set(fk['constrained_columns']) & set(to_convert.get(table_name, ()))
+        or set(fk['referred_columns']) & set(to_convert.get(fk['referred_table'], ()))
+    ]
+
+    for table_name, fk in foreign_keys:
+        conn.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT {fk["name"]}'))
+
+    for table_name, columns in to_convert.items():
+        conn.execute(text(f'ALTER TABLE {table_name} ' + ', '.join(
+            f'ALTER COLUMN {name} TYPE uuid USING {name}::uuid' for name in columns
+        )))
+
+    for table_name, fk in foreign_keys:
+        ondelete = fk.get('options', {}).get('ondelete')
+        conn.execute(text(
+            f'ALTER TABLE {table_name} ADD CONSTRAINT {fk["name"]} '
+            f'FOREIGN KEY ({", ".join(fk["constrained_columns"])}) '
+            f'REFERENCES {fk["referred_table"]} ({", ".join(fk["referred_columns"])})'
+            + (f' ON DELETE {ondelete}' if ondelete else '')
+        ))
+
+
+def _add_missing_columns(conn: Connection):
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                raise RuntimeError(
+                    f"Cannot add NOT NULL column {table.name}.{column.name} to an existing table"
+                )
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def _create_missing_indexes(conn: Connection):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _backfill_plan_blobs(conn: Connection):
+    """Move results stored in the legacy plans.plan_data JSON column into plan_blob."""
+    if 'plan_data' not in {c['name'] for c in inspect(conn).get_columns('plans')}:
+        return
+
+    rows = conn.execute(text(
+        "SELECT id, plan_data FROM plans WHERE plan_blob IS NULL AND plan_data IS NOT NULL"
+    )).all()
+    for plan_id, plan_data in rows:
+        if isinstance(plan_data, (str, bytes)):
+            plan_data = orjson.loads(plan_data)
+        conn.execute(
+            text("UPDATE plans SET plan_blob = :blob, algorithm = COALESCE(algorithm, :algorithm) WHERE id = :id"),
+            {'blob': encode_plan_data(plan_data), 'algorithm': plan_data.get('algorithm'), 'id': plan_id}
+        )
+
+
+def upgrade_schema(engine: Engine):
+    with engine.begin() as conn:
+        _convert_uuid_columns(conn)
+        _add_missing_columns(conn)
+        _create_missing_indexes(conn)
+        _backfill_plan_blobs(conn)
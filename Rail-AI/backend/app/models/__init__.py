@@ -7,9 +7,11 @@ from .models import (
     Order,
     Rake,
     PlanningJob,
+    UploadJob,
     Plan,
     PlanRake,
-    Setting
+    Setting,
+    is_valid_id
 )
 
 __all__ = [
@@ -21,7 +23,9 @@ __all__ = [
     'Order',
     'Rake',
     'PlanningJob',
+    'UploadJob',
     'Plan',
     'PlanRake',
-    'Setting'
+    'Setting',
+    'is_valid_id'
 ]
@@ -1,16 +1,33 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, Boolean, Text, JSON, CheckConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, Boolean, Text, JSON, LargeBinary, CheckConstraint, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
+import orjson
 import uuid
+import zlib
 from ..database import Base
 
+GUID = String().with_variant(UUID(as_uuid=False), "postgresql")
+
 def generate_uuid():
     return str(uuid.uuid4())
 
+def is_valid_id(value: str) -> bool:
+    """Whether value can be bound to a GUID column; PostgreSQL rejects anything else."""
+    try:
+        uuid.UUID(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def encode_plan_data(value: dict) -> bytes:
+    """Serialize a planner result for Plan.plan_blob."""
+    return zlib.compress(orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY))
+
 class Product(Base):
     __tablename__ = "products"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
     code = Column(String, unique=True, nullable=False, index=True)
     name = Column(String, nullable=False)
     density = Column(Float, default=1.5)
@@ -18,10 +35,14 @@ class Product(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_products_created_id', 'created_at', 'id'),
+    )
+
 class WagonType(Base):
     __tablename__ = "wagon_types"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
     code = Column(String, unique=True, nullable=False, index=True)
     name = Column(String, nullable=False)
     capacity_tonnes = Column(Float, nullable=False)
@@ -30,11 +51,15 @@ class WagonType(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_wagon_types_created_id', 'created_at', 'id'),
+    )
+
 class ProductWagonCompatibility(Base):
     __tablename__ = "product_wagon_compatibility"
 
-    product_id = Column(String, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
-    wagon_type_id = Column(String, ForeignKey('wagon_types.id', ondelete='CASCADE'), primary_key=True)
+    product_id = Column(GUID, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    wagon_type_id = Column(GUID, ForeignKey('wagon_types.id', ondelete='CASCADE'), primary_key=True)
     loading_efficiency = Column(Float, default=1.0)
 
     __table_args__ = (
@@ -44,7 +69,7 @@ class ProductWagonCompatibility(Base):
 class Stockyard(Base):
     __tablename__ = "stockyards"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
     code = Column(String, unique=True, nullable=False, index=True)
     name = Column(String, nullable=False)
     location = Column(String, nullable=False)
@@ -55,13 +80,17 @@ class Stockyard(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_stockyards_created_id', 'created_at', 'id'),
+    )
+
 class LoadingPoint(Base):
     __tablename__ = "loading_points"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
     code = Column(String, unique=True, nullable=False, index=True)
     name = Column(String, nullable=False)
-    stockyard_id = Column(String, ForeignKey('stockyards.id', ondelete='SET NULL'), nullable=True)
+    stockyard_id = Column(GUID, ForeignKey('stockyards.id', ondelete='SET NULL'), nullable=True)
     location = Column(String, nullable=False)
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
@@ -71,14 +100,20 @@ class LoadingPoint(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    stockyard = relationship("Stockyard", foreign_keys=[stockyard_id], lazy="raise")
+
+    __table_args__ = (
+        Index('ix_loading_points_created_id', 'created_at', 'id'),
+    )
+
 class Order(Base):
     __tablename__ = "orders"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
     order_number = Column(String, unique=True, nullable=False, index=True)
     product_code = Column(String, nullable=False)
     quantity_tonnes = Column(Float, nullable=False)
-    source_stockyard_id = Column(String, ForeignKey('stockyards.id', ondelete='SET NULL'), nullable=True)
+    source_stockyard_id = Column(GUID, ForeignKey('stockyards.id', ondelete='SET NULL'), nullable=True)
     destination = Column(String, nullable=False)
     destination_latitude = Column(Float, nullable=True)
     destination_longitude = Column(Float, nullable=True)
@@ -89,16 +124,20 @@ class Order(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    source_stockyard = relationship("Stockyard", foreign_keys=[source_stockyard_id], lazy="raise")
+
     __table_args__ = (
         CheckConstraint('quantity_tonnes > 0'),
         CheckConstraint('priority >= 1 AND priority <= 5'),
         CheckConstraint("status IN ('pending', 'assigned', 'fulfilled', 'cancelled')"),
+        Index('ix_orders_status_due', 'status', 'due_date'),
+        Index('ix_orders_created_id', 'created_at', 'id'),
     )
 
 class Rake(Base):
     __tablename__ = "rakes"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
     rake_number = Column(String, unique=True, nullable=False, index=True)
     wagon_type_code = Column(String, nullable=False)
     num_wagons = Column(Integer, nullable=False)
@@ -113,12 +152,13 @@ class Rake(Base):
         CheckConstraint('num_wagons > 0'),
         CheckConstraint('total_capacity_tonnes > 0'),
         CheckConstraint("status IN ('available', 'assigned', 'in_transit', 'maintenance')"),
+        Index('ix_rakes_created_id', 'created_at', 'id'),
     )
 
 class PlanningJob(Base):
     __tablename__ = "planning_jobs"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
     scenario_name = Column(String, nullable=False)
     notes = Column(Text, nullable=True)
     config = Column(JSON, default=dict)
@@ -135,13 +175,34 @@ class PlanningJob(Base):
         CheckConstraint("status IN ('queued', 'running', 'completed', 'failed', 'cancelled')"),
     )
 
+class UploadJob(Base):
+    __tablename__ = "upload_jobs"
+
+    id = Column(GUID, primary_key=True, default=generate_uuid)
+    dataset = Column(String, nullable=False)
+    filename = Column(String, nullable=True)
+    status = Column(String, default='queued', index=True)
+    progress = Column(Float, default=0)
+    records_created = Column(Integer, default=0)
+    errors = Column(JSON, default=list)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        CheckConstraint('progress >= 0 AND progress <= 100'),
+        CheckConstraint("status IN ('queued', 'running', 'completed', 'failed')"),
+    )
+
 class Plan(Base):
     __tablename__ = "plans"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    job_id = Column(String, ForeignKey('planning_jobs.id', ondelete='CASCADE'))
+    id = Column(GUID, primary_key=True, default=generate_uuid)
+    job_id = Column(GUID, ForeignKey('planning_jobs.id', ondelete='CASCADE'))
     name = Column(String, nullable=False)
-    plan_data = Column(JSON, default=dict)
+    algorithm = Column(String, nullable=True)
+    plan_blob = deferred(Column(LargeBinary, nullable=True), raiseload=True)
     total_cost = Column(Float, default=0)
     freight_cost = Column(Float, default=0)
     demurrage_cost = Column(Float, default=0)
@@ -154,13 +215,22 @@ class Plan(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    @property
+    def plan_data(self) -> dict:
+        """Full planner result, stored as zlib-compressed JSON in plan_blob."""
+        return orjson.loads(zlib.decompress(self.plan_blob)) if self.plan_blob else {}
+
+    @plan_data.setter
+    def plan_data(self, value: dict):
+        self.plan_blob = encode_plan_data(value)
+
 class PlanRake(Base):
     __tablename__ = "plan_rakes"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    plan_id = Column(String, ForeignKey('plans.id', ondelete='CASCADE'), index=True)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
+    plan_id = Column(GUID, ForeignKey('plans.id', ondelete='CASCADE'), index=True)
     rake_number = Column(String, nullable=False)
-    origin_stockyard_id = Column(String, ForeignKey('stockyards.id', ondelete='SET NULL'), nullable=True)
+    origin_stockyard_id = Column(GUID, ForeignKey('stockyards.id', ondelete='SET NULL'), nullable=True)
     destinations = Column(JSON, default=list)
     orders_assigned = Column(JSON, default=list)
     total_weight = Column(Float, default=0)
@@ -168,10 +238,12 @@ class PlanRake(Base):
     freight_cost = Column(Float, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    origin_stockyard = relationship("Stockyard", foreign_keys=[origin_stockyard_id], lazy="raise")
+
 class Setting(Base):
     __tablename__ = "settings"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
     key = Column(String, unique=True, nullable=False, index=True)
     value = Column(JSON, default=dict)
     description = Column(Text, nullable=True)
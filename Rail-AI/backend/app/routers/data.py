@@ -1,12 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import JSON, select, insert, update, bindparam, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Tuple
 import pandas as pd
+import base64
+import csv
 import io
-import json
+import orjson
 from datetime import datetime
-from ..database import get_db
+from pydantic import TypeAdapter, ValidationError
+from ..cache import dataset_cache
+from ..database import AsyncSessionLocal, get_async_db
 from ..models import *
+from ..schemas import ProductIn, WagonTypeIn, StockyardIn, LoadingPointIn, OrderIn, RakeIn
 
 router = APIRouter(prefix="/api", tags=["data"])
 
@@ -19,6 +27,48 @@ DATASET_MODELS = {
     'wagon_types': WagonType
 }
 
+DATASET_SCHEMAS = {
+    'stockyards': TypeAdapter(List[StockyardIn]),
+    'orders': TypeAdapter(List[OrderIn]),
+    'rakes': TypeAdapter(List[RakeIn]),
+    'loading_points': TypeAdapter(List[LoadingPointIn]),
+    'products': TypeAdapter(List[ProductIn]),
+    'wagon_types': TypeAdapter(List[WagonTypeIn])
+}
+
+RECORD_BY_ID = {
+    name: select(model).where(model.id == bindparam('id'))
+    for name, model in DATASET_MODELS.items()
+}
+
+EXPORT_BATCH_SIZE = 1000
+
+COPY_THRESHOLD = 10000
+
+# Keys per IN lookup; asyncpg allows at most 32767 bind parameters per query
+LOOKUP_BATCH_SIZE = 5000
+
+NATURAL_KEYS = ('code', 'order_number', 'rake_number')
+
+JSON_COLUMNS = {
+    'stockyards': {'current_inventory_json': 'current_inventory'},
+    'loading_points': {'products_handled_json': 'products_handled'}
+}
+
+# Cached datasets whose rows change with a write to the key dataset through
+# foreign keys (deleting a stockyard nulls their stockyard ids)
+CACHE_DEPENDENTS = {
+    'stockyards': ('stockyards', 'orders', 'loading_points')
+}
+
+def _invalidate_cache(dataset: str):
+    dataset_cache.invalidate(*CACHE_DEPENDENTS.get(dataset, (dataset,)))
+
+STOCKYARD_CODE_COLUMNS = {
+    'orders': ('source_stockyard_code', 'source_stockyard_id'),
+    'loading_points': ('stockyard_code', 'stockyard_id')
+}
+
 TEMPLATES = {
     'stockyards': {
         'headers': ['code', 'name', 'location', 'latitude', 'longitude', 'capacity_tonnes', 'current_inventory_json'],
@@ -46,92 +96,288 @@ TEMPLATES = {
     }
 }
 
+def _render_template(template: Dict[str, List]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(template['headers'])
+    writer.writerow(template['example'])
+    return buffer.getvalue().encode()
+
+TEMPLATE_CSV = {name: _render_template(template) for name, template in TEMPLATES.items()}
+
+def _encode_cursor(created_at: datetime, record_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{record_id}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    created_at, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+    if not is_valid_id(record_id):
+        raise ValueError(f"Invalid record id in cursor: {record_id!r}")
+    return datetime.fromisoformat(created_at), record_id
+
+def _parse_json_cell(value):
+    """Parse a JSON-encoded CSV cell, treating blanks as missing."""
+    if isinstance(value, str):
+        return orjson.loads(value) if value and value != 'None' else None
+    return value
+
 @router.get("/template/{dataset}")
 async def get_template(dataset: str):
     """Return CSV template for a dataset."""
     if dataset not in TEMPLATES:
         raise HTTPException(status_code=404, detail=f"Template for {dataset} not found")
 
-    template = TEMPLATES[dataset]
-    df = pd.DataFrame([template['example']], columns=template['headers'])
-
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_buffer.seek(0)
-
-    from fastapi.responses import StreamingResponse
-    return StreamingResponse(
-        io.BytesIO(csv_buffer.getvalue().encode()),
+    return Response(
+        content=TEMPLATE_CSV[dataset],
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename={dataset}_template.csv"}
     )
 
-@router.post("/upload/{dataset}")
-async def upload_dataset(dataset: str, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Upload and parse CSV data for a dataset."""
+def _csv_cell(value):
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value).decode()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+@router.get("/export/{dataset}")
+async def export_dataset(dataset: str):
+    """Stream all rows of a dataset as CSV."""
     if dataset not in DATASET_MODELS:
         raise HTTPException(status_code=404, detail=f"Dataset {dataset} not found")
 
+    model = DATASET_MODELS[dataset]
+    columns = model.__table__.columns
+    stmt = (
+        select(*columns)
+        .order_by(model.created_at, model.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    async def generate_rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow([c.name for c in columns])
+        yield buffer.getvalue().encode()
+
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(stmt)
+            async for partition in result.partitions():
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows([_csv_cell(value) for value in row] for row in partition)
+                yield buffer.getvalue().encode()
+
+    return StreamingResponse(
+        generate_rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={dataset}.csv"}
+    )
+
+async def copy_insert(db: AsyncSession, model, rows: List[Dict[str, Any]]):
+    """
+    Insert rows through PostgreSQL COPY on the session's connection.
+    COPY bypasses SQLAlchemy, so Python-side column defaults are filled in here.
+    """
+    table = model.__table__
+    columns = list(table.columns)
+
+    records = []
+    for row in rows:
+        record = []
+        for column in columns:
+            if column.name in row:
+                value = row[column.name]
+            elif column.default is not None:
+                value = column.default.arg(None) if column.default.is_callable else column.default.arg
+            else:
+                value = None
+
+            if isinstance(column.type, JSON) and value is not None:
+                value = orjson.dumps(value).decode()
+            record.append(value)
+        records.append(tuple(record))
+
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        table.name,
+        records=records,
+        columns=[column.name for column in columns]
+    )
+
+def _read_csv(dataset: str, source) -> Tuple[pd.DataFrame, set, List[str]]:
+    """
+    Parse the CSV and decode its JSON-encoded columns.
+    Returns the frame, positions of rows with malformed JSON, and their errors.
+    """
+    df = pd.read_csv(source)
+
+    invalid_rows = set()
+    errors = []
+
+    for json_col, target_col in JSON_COLUMNS.get(dataset, {}).items():
+        if json_col in df.columns:
+            parsed = []
+            for row, value in enumerate(df.pop(json_col)):
+                try:
+                    parsed.append(_parse_json_cell(value))
+                except orjson.JSONDecodeError as e:
+                    invalid_rows.add(row)
+                    errors.append(f"Row {row + 1}: {json_col}: Invalid JSON: {e}")
+                    parsed.append(None)
+            df[target_col] = parsed
+
+    return df, invalid_rows, errors
+
+def _validate_rows(
+    dataset: str,
+    df: pd.DataFrame,
+    stockyard_ids: Optional[Dict[str, str]],
+    skipped_rows: set
+) -> Tuple[List[Any], List[str]]:
+    """Validate parsed rows against the dataset schema, skipping invalid rows."""
+    errors = []
+
+    if stockyard_ids is not None:
+        code_col, id_col = STOCKYARD_CODE_COLUMNS[dataset]
+        df[id_col] = df.pop(code_col).map(stockyard_ids)
+
+    df = df.astype(object).where(df.notna(), None)
+
+    records = df.to_dict(orient='records')
+    # CSV positions of the rows handed to the validator
+    rows = [i for i in range(len(records)) if i not in skipped_rows]
+    adapter = DATASET_SCHEMAS[dataset]
+
     try:
-        contents = await file.read()
-        df = pd.read_csv(io.BytesIO(contents))
+        validated = adapter.validate_python([records[i] for i in rows])
+    except ValidationError as e:
+        invalid_rows = set()
+        for error in e.errors(include_url=False):
+            pos, *field = error['loc']
+            invalid_rows.add(pos)
+            errors.append(f"Row {rows[pos] + 1}: {'.'.join(map(str, field))}: {error['msg']}")
+        validated = adapter.validate_python([records[i] for pos, i in enumerate(rows) if pos not in invalid_rows])
+
+    return validated, errors
+
+async def _ids_by_key(db: AsyncSession, model, key_col, keys: List[Any]) -> Dict[Any, str]:
+    """Map natural keys to record ids, looking them up in batches of LOOKUP_BATCH_SIZE."""
+    ids = {}
+    for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+        result = await db.execute(
+            select(model.id, key_col).where(key_col.in_(keys[start:start + LOOKUP_BATCH_SIZE]))
+        )
+        ids.update({key: record_id for record_id, key in result.all()})
+    return ids
+
+async def ingest_csv(
+    db: AsyncSession,
+    dataset: str,
+    source,
+    on_progress: Optional[Callable[[float], Awaitable[None]]] = None
+) -> Tuple[int, List[str]]:
+    """
+    Parse a CSV file-like object and upsert its rows into the dataset table.
+    Returns the number of processed records and per-row error messages.
+    Parsing and validation run in the threadpool to keep the event loop free;
+    on_progress is awaited with a percentage after each of them.
+    """
+    df, json_error_rows, errors = await run_in_threadpool(_read_csv, dataset, source)
+    if on_progress:
+        await on_progress(30)
 
-        df = df.where(pd.notnull(df), None)
+    model = DATASET_MODELS[dataset]
 
-        model = DATASET_MODELS[dataset]
+    records_created = 0
 
-        records_created = 0
-        errors = []
+    stockyard_ids = None
+    if dataset in STOCKYARD_CODE_COLUMNS and STOCKYARD_CODE_COLUMNS[dataset][0] in df.columns:
+        codes = df[STOCKYARD_CODE_COLUMNS[dataset][0]].dropna().unique().tolist()
+        stockyard_ids = await _ids_by_key(db, Stockyard, Stockyard.code, codes)
 
-        for idx, row in df.iterrows():
-            try:
-                record_data = row.to_dict()
-
-                if dataset == 'stockyards' and 'current_inventory_json' in record_data:
-                    inv_str = record_data.pop('current_inventory_json', '{}')
-                    if inv_str and inv_str != 'None':
-                        record_data['current_inventory'] = json.loads(inv_str) if isinstance(inv_str, str) else inv_str
-
-                if dataset == 'loading_points' and 'products_handled_json' in record_data:
-                    ph_str = record_data.pop('products_handled_json', '[]')
-                    if ph_str and ph_str != 'None':
-                        record_data['products_handled'] = json.loads(ph_str) if isinstance(ph_str, str) else ph_str
-
-                if dataset == 'orders' and 'source_stockyard_code' in record_data:
-                    code = record_data.pop('source_stockyard_code', None)
-                    if code:
-                        sy = db.query(Stockyard).filter(Stockyard.code == code).first()
-                        record_data['source_stockyard_id'] = sy.id if sy else None
-
-                if dataset == 'loading_points' and 'stockyard_code' in record_data:
-                    code = record_data.pop('stockyard_code', None)
-                    if code:
-                        sy = db.query(Stockyard).filter(Stockyard.code == code).first()
-                        record_data['stockyard_id'] = sy.id if sy else None
-
-                clean_data = {k: v for k, v in record_data.items() if v is not None and str(v) != 'nan'}
-
-                existing = None
-                if hasattr(model, 'code'):
-                    existing = db.query(model).filter(model.code == clean_data.get('code')).first()
-                elif hasattr(model, 'order_number'):
-                    existing = db.query(model).filter(model.order_number == clean_data.get('order_number')).first()
-                elif hasattr(model, 'rake_number'):
-                    existing = db.query(model).filter(model.rake_number == clean_data.get('rake_number')).first()
-
-                if existing:
-                    for key, value in clean_data.items():
-                        setattr(existing, key, value)
-                else:
-                    record = model(**clean_data)
-                    db.add(record)
-
-                records_created += 1
-
-            except Exception as e:
-                errors.append(f"Row {idx + 1}: {str(e)}")
-
-        db.commit()
+    validated, validation_errors = await run_in_threadpool(
+        _validate_rows, dataset, df, stockyard_ids, json_error_rows
+    )
+    errors.extend(validation_errors)
+    if on_progress:
+        await on_progress(60)
+
+    natural_key = next((k for k in NATURAL_KEYS if hasattr(model, k)), None)
+    existing_ids = {}
+    if natural_key:
+        incoming = list({getattr(item, natural_key) for item in validated})
+        existing_ids = await _ids_by_key(db, model, getattr(model, natural_key), incoming)
+
+    new_rows = {}
+    updated_rows = {}
+
+    for item in validated:
+        clean_data = item.model_dump(exclude_none=True)
+        key = clean_data[natural_key]
+
+        if key in existing_ids:
+            updated_rows.setdefault(key, {'id': existing_ids[key]}).update(clean_data)
+        else:
+            new_rows.setdefault(key, {}).update(clean_data)
+
+        records_created += 1
+
+    if new_rows:
+        if len(new_rows) > COPY_THRESHOLD and db.bind.dialect.name == 'postgresql':
+            await copy_insert(db, model, list(new_rows.values()))
+        else:
+            await db.execute(insert(model), list(new_rows.values()))
+    if updated_rows:
+        await db.execute(update(model), list(updated_rows.values()))
+    await db.commit()
+    _invalidate_cache(dataset)
+
+    return records_created, errors
+
+async def execute_upload_job(job_id: str, dataset: str, contents: bytes):
+    """
+    Background task to ingest an uploaded CSV.
+    Updates upload job status with the ingestion outcome.
+    """
+    async with AsyncSessionLocal() as db:
+        job = await db.get(UploadJob, job_id)
+        if not job:
+            return
+
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        await db.commit()
+
+        async def report_progress(progress: float):
+            job.progress = progress
+            await db.commit()
+
+        try:
+            records_created, errors = await ingest_csv(db, dataset, io.BytesIO(contents), report_progress)
+
+            job.status = 'completed'
+            job.progress = 100
+            job.records_created = records_created
+            job.errors = errors[:10]
+
+        except Exception as e:
+            await db.rollback()
+            job = await db.get(UploadJob, job_id)
+            job.status = 'failed'
+            job.errors = [f"Error processing CSV: {str(e)}"]
+
+        job.completed_at = datetime.utcnow()
+        await db.commit()
+
+@router.post("/upload/{dataset}")
+async def upload_dataset(dataset: str, file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
+    """Upload and parse CSV data for a dataset."""
+    if dataset not in DATASET_MODELS:
+        raise HTTPException(status_code=404, detail=f"Dataset {dataset} not found")
+
+    try:
+        records_created, errors = await ingest_csv(db, dataset, file.file)
 
         return {
             "message": f"Successfully processed {records_created} records for {dataset}",
@@ -142,35 +388,108 @@ async def upload_dataset(dataset: str, file: UploadFile = File(...), db: Session
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing CSV: {str(e)}")
 
+@router.post("/upload/{dataset}/async")
+async def upload_dataset_async(
+    dataset: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Queue a CSV upload for background ingestion.
+    Returns job ID for status tracking.
+    """
+    if dataset not in DATASET_MODELS:
+        raise HTTPException(status_code=404, detail=f"Dataset {dataset} not found")
+
+    contents = await file.read()
+
+    job = UploadJob(dataset=dataset, filename=file.filename, status='queued')
+    db.add(job)
+    await db.commit()
+
+    background_tasks.add_task(execute_upload_job, job.id, dataset, contents)
+
+    return {
+        "job_id": job.id,
+        "status": "queued",
+        "message": "Upload job queued successfully"
+    }
+
+@router.get("/upload/status/{job_id}")
+async def get_upload_status(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Get current status and outcome of an upload job."""
+    job = await db.get(UploadJob, job_id) if is_valid_id(job_id) else None
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+
+    return {
+        "job_id": job.id,
+        "dataset": job.dataset,
+        "filename": job.filename,
+        "status": job.status,
+        "progress": job.progress,
+        "records_created": job.records_created,
+        "errors": job.errors or [],
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None
+    }
+
 @router.get("/{dataset}")
-async def get_dataset(dataset: str, skip: int = 0, limit: int = 1000, db: Session = Depends(get_db)):
-    """Fetch dataset rows with pagination."""
+async def get_dataset(
+    dataset: str,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 1000,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Fetch dataset rows ordered by (created_at, id).
+    Pass the returned next_cursor to fetch the following page; skip is
+    only applied when no cursor is given.
+    """
     if dataset not in DATASET_MODELS:
         raise HTTPException(status_code=404, detail=f"Dataset {dataset} not found")
 
-    model = DATASET_MODELS[dataset]
-    records = db.query(model).offset(skip).limit(limit).all()
+    cache_key = (cursor, skip, limit)
+    cached = dataset_cache.get(dataset, cache_key)
+    if cached is None:
+        model = DATASET_MODELS[dataset]
+        stmt = select(*model.__table__.columns).order_by(model.created_at, model.id).limit(limit)
+
+        if cursor:
+            try:
+                created_at, record_id = _decode_cursor(cursor)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            stmt = stmt.where(tuple_(model.created_at, model.id) > (created_at, record_id))
+        else:
+            stmt = stmt.offset(skip)
+
+        rows = await db.execute(stmt)
 
-    result = []
-    for record in records:
-        record_dict = {c.name: getattr(record, c.name) for c in record.__table__.columns}
+        result = [dict(row) for row in rows.mappings()]
 
-        for key, value in record_dict.items():
-            if isinstance(value, datetime):
-                record_dict[key] = value.isoformat()
+        next_cursor = None
+        if result and len(result) == limit:
+            next_cursor = _encode_cursor(result[-1]['created_at'], result[-1]['id'])
 
-        result.append(record_dict)
+        cached = orjson.dumps({"data": result, "count": len(result), "next_cursor": next_cursor})
+        dataset_cache.set(dataset, cache_key, cached)
 
-    return {"data": result, "count": len(result)}
+    return Response(content=cached, media_type="application/json")
 
 @router.put("/{dataset}/{id}")
-async def update_record(dataset: str, id: str, data: Dict[str, Any], db: Session = Depends(get_db)):
+async def update_record(dataset: str, id: str, data: Dict[str, Any], db: AsyncSession = Depends(get_async_db)):
     """Update a single record."""
     if dataset not in DATASET_MODELS:
         raise HTTPException(status_code=404, detail=f"Dataset {dataset} not found")
 
-    model = DATASET_MODELS[dataset]
-    record = db.query(model).filter(model.id == id).first()
+    record = None
+    if is_valid_id(id):
+        result = await db.execute(RECORD_BY_ID[dataset], {'id': id})
+        record = result.scalar_one_or_none()
 
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
@@ -179,24 +498,27 @@ async def update_record(dataset: str, id: str, data: Dict[str, Any], db: Session
         if hasattr(record, key):
             setattr(record, key, value)
 
-    db.commit()
-    db.refresh(record)
+    await db.commit()
+    _invalidate_cache(dataset)
 
     return {"message": "Record updated successfully"}
 
 @router.delete("/{dataset}/{id}")
-async def delete_record(dataset: str, id: str, db: Session = Depends(get_db)):
+async def delete_record(dataset: str, id: str, db: AsyncSession = Depends(get_async_db)):
     """Delete a single record."""
     if dataset not in DATASET_MODELS:
         raise HTTPException(status_code=404, detail=f"Dataset {dataset} not found")
 
-    model = DATASET_MODELS[dataset]
-    record = db.query(model).filter(model.id == id).first()
+    record = None
+    if is_valid_id(id):
+        result = await db.execute(RECORD_BY_ID[dataset], {'id': id})
+        record = result.scalar_one_or_none()
 
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
 
-    db.delete(record)
-    db.commit()
+    await db.delete(record)
+    await db.commit()
+    _invalidate_cache(dataset)
 
     return {"message": "Record deleted successfully"}
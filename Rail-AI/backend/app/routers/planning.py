@@ -1,15 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
 from typing import Dict, Any
 from datetime import datetime
 import asyncio
+import sys
 import traceback
-from ..database import get_db
+from ..cache import dataset_cache
+from ..database import AsyncSessionLocal, get_async_db
 from ..models import *
 from ..services import run_planner
+from ..services.planner import EPOCH
 
 router = APIRouter(prefix="/api", tags=["planning"])
 
+# Futures of planning jobs submitted to the planner process pool, by job id
+planning_futures: Dict[str, Future] = {}
+
+async def planner_worker(state):
+    """
+    Feed queued planning jobs to the planner process pool one at a time.
+    A job that cannot run is marked failed; a broken pool is replaced so
+    the remaining jobs keep draining.
+    """
+    while True:
+        job_id, config = await state.planner_queue.get()
+        pool = state.planner_pool
+        try:
+            future = pool.submit(execute_planning_job, job_id, config)
+            planning_futures[job_id] = future
+            await asyncio.wait([asyncio.wrap_future(future)])
+            if not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool) and state.planner_pool is pool:
+                state.planner_pool = state.create_planner_pool()
+                pool.shutdown(wait=False)
+            await fail_planning_job(job_id, e)
+        finally:
+            planning_futures.pop(job_id, None)
+            state.planner_queue.task_done()
+
+async def fail_planning_job(job_id: str, error: Exception):
+    """Mark a planning job failed when it could not run in the planner pool."""
+    async with AsyncSessionLocal() as db:
+        job = await db.get(PlanningJob, job_id)
+        if not job or job.status in ('completed', 'failed', 'cancelled'):
+            return
+        job.status = 'failed'
+        job.completed_at = datetime.utcnow()
+        job.logs = (job.logs or "") + f"[{datetime.utcnow()}] ERROR: {error!r}\n"
+        await db.commit()
+
 def execute_planning_job(job_id: str, config: Dict[str, Any]):
     """
     Background task to execute planning job.
@@ -18,37 +65,54 @@ def execute_planning_job(job_id: str, config: Dict[str, Any]):
     from ..database import SessionLocal
 
     db = SessionLocal()
+    log_buf = []
+
+    def save_progress(**values) -> bool:
+        """
+        Write progress and the log so far, unless the job was cancelled meanwhile.
+        Lines appended by cancel_job are kept since cancelled rows are left alone.
+        """
+        result = db.execute(
+            update(PlanningJob)
+            .where(PlanningJob.id == job_id, PlanningJob.status != 'cancelled')
+            .values(logs="".join(log_buf), **values)
+        )
+        if result.rowcount == 0:
+            db.rollback()
+            return False
+        db.commit()
+        return True
 
     try:
         job = db.query(PlanningJob).filter(PlanningJob.id == job_id).first()
-        if not job:
+        if not job or job.status == 'cancelled':
             return
 
-        job.status = 'running'
-        job.started_at = datetime.utcnow()
-        job.logs += f"[{datetime.utcnow()}] Starting planning job\n"
-        db.commit()
+        log_buf.append(job.logs or "")
+        log_buf.append(f"[{datetime.utcnow()}] Starting planning job\n")
+        if not save_progress(status='running', started_at=datetime.utcnow()):
+            return
 
         orders = db.query(Order).filter(Order.status == 'pending').all()
         stockyards = db.query(Stockyard).all()
         rakes = db.query(Rake).filter(Rake.status == 'available').all()
 
-        job.logs += f"[{datetime.utcnow()}] Loaded {len(orders)} orders, {len(stockyards)} stockyards, {len(rakes)} rakes\n"
-        job.progress = 20
-        db.commit()
+        log_buf.append(f"[{datetime.utcnow()}] Loaded {len(orders)} orders, {len(stockyards)} stockyards, {len(rakes)} rakes\n")
+        if not save_progress(progress=20):
+            return
 
         orders_data = [
             {
                 'id': o.id,
                 'order_number': o.order_number,
-                'product_code': o.product_code,
+                'product_code': sys.intern(o.product_code),
                 'quantity_tonnes': o.quantity_tonnes,
                 'source_stockyard_id': o.source_stockyard_id,
-                'destination': o.destination,
+                'destination': sys.intern(o.destination),
                 'destination_latitude': o.destination_latitude,
                 'destination_longitude': o.destination_longitude,
                 'priority': o.priority,
-                'due_date': o.due_date,
+                'due_date_epoch': int((o.due_date - EPOCH).total_seconds()),
                 'sla_hours': o.sla_hours
             }
             for o in orders
@@ -57,13 +121,16 @@ def execute_planning_job(job_id: str, config: Dict[str, Any]):
         stockyards_data = [
             {
                 'id': s.id,
-                'code': s.code,
+                'code': sys.intern(s.code),
                 'name': s.name,
                 'location': s.location,
                 'latitude': s.latitude,
                 'longitude': s.longitude,
                 'capacity_tonnes': s.capacity_tonnes,
-                'current_inventory': s.current_inventory or {}
+                'current_inventory': {
+                    sys.intern(product_code): qty
+                    for product_code, qty in (s.current_inventory or {}).items()
+                }
             }
             for s in stockyards
         ]
@@ -81,9 +148,9 @@ def execute_planning_job(job_id: str, config: Dict[str, Any]):
             for r in rakes
         ]
 
-        job.logs += f"[{datetime.utcnow()}] Running {config.get('mode', 'greedy')} planner\n"
-        job.progress = 40
-        db.commit()
+        log_buf.append(f"[{datetime.utcnow()}] Running {config.get('mode', 'greedy')} planner\n")
+        if not save_progress(progress=40):
+            return
 
         plan_result = run_planner(
             mode=config.get('mode', 'greedy'),
@@ -93,13 +160,14 @@ def execute_planning_job(job_id: str, config: Dict[str, Any]):
             rakes=rakes_data
         )
 
-        job.logs += f"[{datetime.utcnow()}] Planning completed. Generated {len(plan_result['rakes'])} rake assignments\n"
-        job.progress = 80
-        db.commit()
+        log_buf.append(f"[{datetime.utcnow()}] Planning completed. Generated {len(plan_result['rakes'])} rake assignments\n")
+        if not save_progress(progress=80):
+            return
 
         plan = Plan(
             job_id=job_id,
             name=job.scenario_name,
+            algorithm=plan_result['algorithm'],
             plan_data=plan_result,
             total_cost=plan_result['total_cost'],
             freight_cost=plan_result['freight_cost'],
@@ -110,43 +178,37 @@ def execute_planning_job(job_id: str, config: Dict[str, Any]):
             total_orders=plan_result['total_orders']
         )
         db.add(plan)
-        db.commit()
-        db.refresh(plan)
-
-        for rake_plan in plan_result['rakes']:
-            origin_sy = None
-            if rake_plan.get('origin_stockyard_code'):
-                origin_sy = db.query(Stockyard).filter(
-                    Stockyard.code == rake_plan['origin_stockyard_code']
-                ).first()
-
-            plan_rake = PlanRake(
-                plan_id=plan.id,
-                rake_number=rake_plan['rake_number'],
-                origin_stockyard_id=origin_sy.id if origin_sy else None,
-                destinations=rake_plan['destinations'],
-                orders_assigned=rake_plan['orders'],
-                total_weight=rake_plan['total_weight'],
-                utilization_pct=rake_plan['utilization_pct'],
-                freight_cost=rake_plan['freight_cost']
-            )
-            db.add(plan_rake)
+        db.flush()
+        plan_id = plan.id
 
-        db.commit()
+        stockyard_ids = {s['code']: s['id'] for s in stockyards_data}
 
-        job.status = 'completed'
-        job.completed_at = datetime.utcnow()
-        job.progress = 100
-        job.logs += f"[{datetime.utcnow()}] Job completed successfully. Plan ID: {plan.id}\n"
-        db.commit()
+        plan_rake_rows = [
+            {
+                'plan_id': plan_id,
+                'rake_number': rake_plan['rake_number'],
+                'origin_stockyard_id': stockyard_ids.get(rake_plan.get('origin_stockyard_code')),
+                'destinations': rake_plan['destinations'],
+                'orders_assigned': rake_plan['orders'],
+                'total_weight': rake_plan['total_weight'],
+                'utilization_pct': rake_plan['utilization_pct'],
+                'freight_cost': rake_plan['freight_cost']
+            }
+            for rake_plan in plan_result['rakes']
+        ]
+        if plan_rake_rows:
+            db.execute(insert(PlanRake), plan_rake_rows)
+
+        # The plan is only kept if the job was not cancelled while it was built
+        log_buf.append(f"[{datetime.utcnow()}] Job completed successfully. Plan ID: {plan_id}\n")
+        save_progress(status='completed', completed_at=datetime.utcnow(), progress=100)
 
     except Exception as e:
-        job = db.query(PlanningJob).filter(PlanningJob.id == job_id).first()
-        if job:
-            job.status = 'failed'
-            job.completed_at = datetime.utcnow()
-            job.logs += f"[{datetime.utcnow()}] ERROR: {str(e)}\n{traceback.format_exc()}\n"
-            db.commit()
+        db.rollback()
+        if not log_buf:
+            log_buf.append(db.query(PlanningJob.logs).filter(PlanningJob.id == job_id).scalar() or "")
+        log_buf.append(f"[{datetime.utcnow()}] ERROR: {str(e)}\n{traceback.format_exc()}\n")
+        save_progress(status='failed', completed_at=datetime.utcnow())
 
     finally:
         db.close()
@@ -155,12 +217,12 @@ def execute_planning_job(job_id: str, config: Dict[str, Any]):
 async def generate_plan(
     scenario_name: str,
     config: Dict[str, Any],
+    request: Request,
     notes: str = None,
-    background_tasks: BackgroundTasks = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Create a new planning job and run planner in background.
+    Create a new planning job and queue it for the planner workers.
     Returns job ID for status tracking.
     """
     job = PlanningJob(
@@ -170,10 +232,9 @@ async def generate_plan(
         status='queued'
     )
     db.add(job)
-    db.commit()
-    db.refresh(job)
+    await db.commit()
 
-    background_tasks.add_task(execute_planning_job, job.id, config)
+    await request.app.state.planner_queue.put((job.id, config))
 
     return {
         "job_id": job.id,
@@ -182,16 +243,17 @@ async def generate_plan(
     }
 
 @router.get("/job/{job_id}/status")
-async def get_job_status(job_id: str, db: Session = Depends(get_db)):
+async def get_job_status(job_id: str, db: AsyncSession = Depends(get_async_db)):
     """Get current status and logs for a planning job."""
-    job = db.query(PlanningJob).filter(PlanningJob.id == job_id).first()
+    job = await db.get(PlanningJob, job_id) if is_valid_id(job_id) else None
 
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
     plan = None
     if job.status == 'completed':
-        plan = db.query(Plan).filter(Plan.job_id == job_id).first()
+        result = await db.execute(select(Plan).where(Plan.job_id == job_id).limit(1))
+        plan = result.scalar_one_or_none()
 
     return {
         "job_id": job.id,
@@ -205,9 +267,9 @@ async def get_job_status(job_id: str, db: Session = Depends(get_db)):
     }
 
 @router.post("/job/{job_id}/cancel")
-async def cancel_job(job_id: str, db: Session = Depends(get_db)):
+async def cancel_job(job_id: str, db: AsyncSession = Depends(get_async_db)):
     """Cancel a running or queued job."""
-    job = db.query(PlanningJob).filter(PlanningJob.id == job_id).first()
+    job = await db.get(PlanningJob, job_id) if is_valid_id(job_id) else None
 
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
@@ -215,22 +277,31 @@ async def cancel_job(job_id: str, db: Session = Depends(get_db)):
     if job.status in ['completed', 'failed', 'cancelled']:
         raise HTTPException(status_code=400, detail="Cannot cancel job in current state")
 
+    future = planning_futures.pop(job_id, None)
+    if future:
+        future.cancel()
+
     job.status = 'cancelled'
     job.completed_at = datetime.utcnow()
     job.logs += f"[{datetime.utcnow()}] Job cancelled by user\n"
-    db.commit()
+    await db.commit()
 
     return {"message": "Job cancelled successfully"}
 
 @router.get("/plan/{plan_id}")
-async def get_plan(plan_id: str, db: Session = Depends(get_db)):
+async def get_plan(plan_id: str, db: AsyncSession = Depends(get_async_db)):
     """Get complete plan details including rake assignments."""
-    plan = db.query(Plan).filter(Plan.id == plan_id).first()
+    plan = await db.get(Plan, plan_id) if is_valid_id(plan_id) else None
 
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
 
-    plan_rakes = db.query(PlanRake).filter(PlanRake.plan_id == plan_id).all()
+    result = await db.execute(
+        select(PlanRake)
+        .options(selectinload(PlanRake.origin_stockyard))
+        .where(PlanRake.plan_id == plan_id)
+    )
+    plan_rakes = result.scalars().all()
 
     rakes_data = []
     for pr in plan_rakes:
@@ -245,11 +316,9 @@ async def get_plan(plan_id: str, db: Session = Depends(get_db)):
             'freight_cost': pr.freight_cost
         }
 
-        if pr.origin_stockyard_id:
-            origin = db.query(Stockyard).filter(Stockyard.id == pr.origin_stockyard_id).first()
-            if origin:
-                rake_data['origin_stockyard_name'] = origin.name
-                rake_data['origin_stockyard_code'] = origin.code
+        if pr.origin_stockyard:
+            rake_data['origin_stockyard_name'] = pr.origin_stockyard.name
+            rake_data['origin_stockyard_code'] = pr.origin_stockyard.code
 
         rakes_data.append(rake_data)
 
@@ -268,26 +337,27 @@ async def get_plan(plan_id: str, db: Session = Depends(get_db)):
         "committed_at": plan.committed_at.isoformat() if plan.committed_at else None,
         "created_at": plan.created_at.isoformat(),
         "rakes": rakes_data,
-        "algorithm": plan.plan_data.get('algorithm', 'unknown')
+        "algorithm": plan.algorithm or 'unknown'
     }
 
 @router.post("/plan/{plan_id}/explain")
-async def explain_plan(plan_id: str, db: Session = Depends(get_db)):
+async def explain_plan(plan_id: str, db: AsyncSession = Depends(get_async_db)):
     """
     Generate natural language explanation for a plan.
     This is a stub that provides structured explanation.
     TODO: Replace with actual LLM API call (OpenAI, HuggingFace, etc.)
     """
-    plan = db.query(Plan).filter(Plan.id == plan_id).first()
+    plan = await db.get(Plan, plan_id) if is_valid_id(plan_id) else None
 
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
 
-    plan_rakes = db.query(PlanRake).filter(PlanRake.plan_id == plan_id).all()
+    result = await db.execute(select(PlanRake).where(PlanRake.plan_id == plan_id))
+    plan_rakes = result.scalars().all()
 
     explanation = f"""## Plan Summary: {plan.name}
 
-This plan was generated using the {plan.plan_data.get('algorithm', 'unknown')} algorithm and successfully allocated {plan.orders_fulfilled} out of {plan.total_orders} orders across {len(plan_rakes)} rakes.
+This plan was generated using the {plan.algorithm or 'unknown'} algorithm and successfully allocated {plan.orders_fulfilled} out of {plan.total_orders} orders across {len(plan_rakes)} rakes.
 
 ### Cost Breakdown
 - **Total Cost**: ₹{plan.total_cost:,.2f}
@@ -327,9 +397,9 @@ Average rake utilization is {plan.utilization_pct:.1f}%. {'This meets the target
     }
 
 @router.post("/plan/{plan_id}/commit")
-async def commit_plan(plan_id: str, db: Session = Depends(get_db)):
+async def commit_plan(plan_id: str, db: AsyncSession = Depends(get_async_db)):
     """Mark a plan as committed for execution."""
-    plan = db.query(Plan).filter(Plan.id == plan_id).first()
+    plan = await db.get(Plan, plan_id) if is_valid_id(plan_id) else None
 
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
@@ -340,19 +410,25 @@ async def commit_plan(plan_id: str, db: Session = Depends(get_db)):
     plan.committed = True
     plan.committed_at = datetime.utcnow()
 
-    plan_rakes = db.query(PlanRake).filter(PlanRake.plan_id == plan_id).all()
+    result = await db.execute(select(PlanRake).where(PlanRake.plan_id == plan_id))
+    plan_rakes = result.scalars().all()
 
-    for plan_rake in plan_rakes:
-        rake = db.query(Rake).filter(Rake.rake_number == plan_rake.rake_number).first()
-        if rake:
-            rake.status = 'assigned'
+    rake_numbers = [pr.rake_number for pr in plan_rakes]
+    order_ids = [o['order_id'] for pr in plan_rakes for o in pr.orders_assigned]
 
-        for order_data in plan_rake.orders_assigned:
-            order = db.query(Order).filter(Order.id == order_data['order_id']).first()
-            if order:
-                order.status = 'assigned'
+    if rake_numbers:
+        await db.execute(
+            update(Rake).where(Rake.rake_number.in_(rake_numbers)).values(status='assigned'),
+            execution_options={'synchronize_session': False}
+        )
+    if order_ids:
+        await db.execute(
+            update(Order).where(Order.id.in_(order_ids)).values(status='assigned'),
+            execution_options={'synchronize_session': False}
+        )
 
-    db.commit()
+    await db.commit()
+    dataset_cache.invalidate('rakes', 'orders')
 
     return {
         "message": "Plan committed successfully",
@@ -0,0 +1,67 @@
+from pydantic import BaseModel, BeforeValidator, Field
+from typing import Annotated, Dict, List, Literal, Optional, Union
+from datetime import datetime
+
+def _to_str(value):
+    return str(value) if isinstance(value, (int, float)) else value
+
+def _to_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+CSVStr = Annotated[str, BeforeValidator(_to_str)]
+CSVDateTime = Annotated[datetime, BeforeValidator(_to_datetime)]
+
+class ProductIn(BaseModel):
+    code: CSVStr
+    name: CSVStr
+    density: Optional[float] = None
+    handling_time: Optional[float] = None
+
+class WagonTypeIn(BaseModel):
+    code: CSVStr
+    name: CSVStr
+    capacity_tonnes: float
+    capacity_volume: Optional[float] = None
+    tare_weight: Optional[float] = None
+
+class StockyardIn(BaseModel):
+    code: CSVStr
+    name: CSVStr
+    location: CSVStr
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    capacity_tonnes: Optional[float] = None
+    current_inventory: Optional[Dict[str, Union[int, float]]] = None
+
+class LoadingPointIn(BaseModel):
+    code: CSVStr
+    name: CSVStr
+    stockyard_id: Optional[str] = None
+    location: CSVStr
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    sidings: Optional[int] = None
+    max_rake_length: Optional[int] = None
+    products_handled: Optional[List[str]] = None
+
+class OrderIn(BaseModel):
+    order_number: CSVStr
+    product_code: CSVStr
+    quantity_tonnes: float = Field(gt=0)
+    source_stockyard_id: Optional[str] = None
+    destination: CSVStr
+    destination_latitude: Optional[float] = None
+    destination_longitude: Optional[float] = None
+    priority: Optional[int] = Field(default=None, ge=1, le=5)
+    due_date: CSVDateTime
+    sla_hours: Optional[float] = None
+    status: Optional[Literal['pending', 'assigned', 'fulfilled', 'cancelled']] = None
+
+class RakeIn(BaseModel):
+    rake_number: CSVStr
+    wagon_type_code: CSVStr
+    num_wagons: int = Field(gt=0)
+    total_capacity_tonnes: float = Field(gt=0)
+    status: Optional[Literal['available', 'assigned', 'in_transit', 'maintenance']] = None
+    current_location: Optional[CSVStr] = None
+    availability_date: Optional[CSVDateTime] = None
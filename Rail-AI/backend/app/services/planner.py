@@ -1,8 +1,17 @@
 import math
+import os
+import numpy as np
+from collections import defaultdict
 from typing import List, Dict, Any, Tuple
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from ortools.sat.python import cp_model
 
+EPOCH = datetime(1970, 1, 1)
+
+# Haversine `a` for the 500 km distance assumed when coordinates are missing
+FALLBACK_DISTANCE_RANK = math.sin(500 / 6371 / 2) ** 2
+
 class GreedyPlanner:
     """
     Greedy planner that:
@@ -40,7 +49,7 @@ class GreedyPlanner:
         """
         sorted_orders = sorted(
             orders,
-            key=lambda o: (o.get('priority', 3), o.get('due_date', datetime.max))
+            key=self._order_sort_key
         )
 
         available_rakes = [r for r in rakes if r.get('status') == 'available']
@@ -49,18 +58,24 @@ class GreedyPlanner:
             sy['code']: dict(sy.get('current_inventory', {})) for sy in stockyards
         }
 
+        self._index_stockyard_coordinates(stockyards)
+        self._index_order_destinations(sorted_orders)
+        self._distance_cache = {}
+        self._index_stockyard_inventory(stockyards, stockyard_inventory)
+
         plan_rakes = []
         assigned_orders = set()
+        remaining_orders = sorted_orders
         total_freight = 0
         total_demurrage = 0
         total_idle = 0
 
         for rake in available_rakes:
-            if len(assigned_orders) >= len(sorted_orders):
+            if not remaining_orders:
                 break
 
             rake_plan = self._pack_rake(
-                rake, sorted_orders, assigned_orders,
+                rake, remaining_orders,
                 stockyards, stockyard_inventory
             )
 
@@ -71,8 +86,8 @@ class GreedyPlanner:
                 total_demurrage += rake_plan.get('demurrage_cost', 0)
                 total_idle += rake_plan.get('idle_cost', 0)
 
-                for order_id in rake_plan['order_ids']:
-                    assigned_orders.add(order_id)
+                assigned_orders.update(rake_plan['order_ids'])
+                remaining_orders = [o for o in remaining_orders if o['id'] not in assigned_orders]
 
         total_cost = (
             self.freight_weight * total_freight +
@@ -94,15 +109,31 @@ class GreedyPlanner:
             'algorithm': 'greedy'
         }
 
+    @staticmethod
+    def _order_sort_key(order: Dict) -> Tuple[int, float]:
+        """
+        Priority, then due time as epoch seconds (due_date_epoch, else derived from due_date).
+        Naive due dates are taken as UTC; orders without one sort last.
+        """
+        due = order.get('due_date_epoch')
+        if due is None:
+            due_date = order.get('due_date')
+            if due_date is None:
+                due = math.inf
+            elif due_date.tzinfo is not None:
+                due = due_date.timestamp()
+            else:
+                due = (due_date - EPOCH).total_seconds()
+        return (order.get('priority', 3), due)
+
     def _pack_rake(
         self,
         rake: Dict,
         orders: List[Dict],
-        assigned: set,
         stockyards: List[Dict],
         inventory: Dict[str, Dict]
     ) -> Dict[str, Any]:
-        """Pack orders into a single rake using greedy selection."""
+        """Pack still-unassigned orders into a single rake using greedy selection."""
         rake_capacity = rake['total_capacity_tonnes']
         current_weight = 0
         rake_orders = []
@@ -111,9 +142,6 @@ class GreedyPlanner:
         freight_cost = 0
 
         for order in orders:
-            if order['id'] in assigned:
-                continue
-
             order_weight = order['quantity_tonnes']
 
             if current_weight + order_weight > rake_capacity:
@@ -141,15 +169,20 @@ class GreedyPlanner:
                 available = inventory[source_sy['code']][product_code]
                 if available >= order_weight:
                     inventory[source_sy['code']][product_code] -= order_weight
+                    if inventory[source_sy['code']][product_code] <= 0:
+                        self._evict_from_inventory_index(product_code, source_sy['code'], stockyards)
 
                     current_weight += order_weight
                     destinations.add(destination)
 
-                    distance = self._calculate_distance(
-                        source_sy,
-                        {'latitude': order.get('destination_latitude'),
-                         'longitude': order.get('destination_longitude')}
-                    )
+                    distance_key = (source_sy['code'], order['id'])
+                    distance = self._distance_cache.get(distance_key)
+                    if distance is None:
+                        distance = self._calculate_distance(
+                            self._sy_rad[source_sy['code']],
+                            self._dest_rad[order['id']]
+                        )
+                        self._distance_cache[distance_key] = distance
 
                     order_freight = distance * order_weight * self.freight_rate
                     freight_cost += order_freight
@@ -204,39 +237,77 @@ class GreedyPlanner:
         product_code = order['product_code']
         required_qty = order['quantity_tonnes']
 
-        candidates = []
-        for sy in stockyards:
-            if product_code in inventory.get(sy['code'], {}):
-                available = inventory[sy['code']][product_code]
-                if available >= required_qty:
-                    candidates.append(sy)
+        candidates = [
+            idx for idx in self._product_index.get(product_code, ())
+            if inventory[stockyards[idx]['code']][product_code] >= required_qty
+        ]
 
         if not candidates:
             return None
 
-        if order.get('destination_latitude') and order.get('destination_longitude'):
-            candidates.sort(
-                key=lambda sy: self._calculate_distance(
-                    sy,
-                    {'latitude': order['destination_latitude'],
-                     'longitude': order['destination_longitude']}
-                )
-            )
-            return candidates[0]
+        dest_rad = self._dest_rad[order['id']]
+        if dest_rad:
+            ranks = self._distance_ranks_from_stockyards(np.array(candidates), *dest_rad)
+            return stockyards[candidates[int(np.argmin(ranks))]]
         else:
-            candidates.sort(
-                key=lambda sy: inventory[sy['code']].get(product_code, 0),
-                reverse=True
+            best = max(
+                candidates,
+                key=lambda idx: inventory[stockyards[idx]['code']].get(product_code, 0)
             )
-            return candidates[0]
+            return stockyards[best]
+
+    def _index_stockyard_inventory(self, stockyards: List[Dict], inventory: Dict[str, Dict]):
+        """Map each product to the positions of stockyards that hold it."""
+        self._product_index = defaultdict(list)
+        for idx, sy in enumerate(stockyards):
+            for product_code in inventory.get(sy['code'], {}):
+                self._product_index[product_code].append(idx)
+
+    def _evict_from_inventory_index(self, product_code: str, sy_code: str, stockyards: List[Dict]):
+        """Drop a stockyard from a product bucket once its stock is exhausted."""
+        self._product_index[product_code] = [
+            idx for idx in self._product_index[product_code]
+            if stockyards[idx]['code'] != sy_code
+        ]
+
+    def _index_stockyard_coordinates(self, stockyards: List[Dict]):
+        """Cache stockyard coordinates in radians for vectorized distance lookups."""
+        self._sy_has_coords = np.array(
+            [bool(sy.get('latitude') and sy.get('longitude')) for sy in stockyards]
+        )
+        self._sy_lat = np.radians([sy.get('latitude') or 0.0 for sy in stockyards])
+        self._sy_lon = np.radians([sy.get('longitude') or 0.0 for sy in stockyards])
+        self._sy_rad = {
+            sy['code']: (math.radians(sy['latitude']), math.radians(sy['longitude']))
+            if sy.get('latitude') and sy.get('longitude') else None
+            for sy in stockyards
+        }
+
+    def _index_order_destinations(self, orders: List[Dict]):
+        """Cache order destination coordinates in radians, None when missing."""
+        self._dest_rad = {
+            o['id']: (math.radians(o['destination_latitude']), math.radians(o['destination_longitude']))
+            if o.get('destination_latitude') and o.get('destination_longitude') else None
+            for o in orders
+        }
+
+    def _distance_ranks_from_stockyards(self, idx: np.ndarray, lat2: float, lon2: float) -> np.ndarray:
+        """
+        Haversine term `a` from the indexed stockyards to a destination in radians.
+        Distance grows monotonically with `a`, so it ranks stockyards without asin/sqrt.
+        """
+        lat1 = self._sy_lat[idx]
+        lon1 = self._sy_lon[idx]
 
-    def _calculate_distance(self, origin: Dict, destination: Dict) -> float:
-        """Calculate distance between two points (haversine or simple)."""
-        if (origin.get('latitude') and origin.get('longitude') and
-            destination.get('latitude') and destination.get('longitude')):
+        a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * math.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
 
-            lat1, lon1 = math.radians(origin['latitude']), math.radians(origin['longitude'])
-            lat2, lon2 = math.radians(destination['latitude']), math.radians(destination['longitude'])
+        return np.where(self._sy_has_coords[idx], a, FALLBACK_DISTANCE_RANK)
+
+    def _calculate_distance(self, origin_rad: Tuple[float, float], destination_rad: Tuple[float, float]) -> float:
+        """Calculate distance between two (lat, lon) points in radians (haversine or simple)."""
+        if origin_rad and destination_rad:
+            lat1, lon1 = origin_rad
+            lat2, lon2 = destination_rad
 
             dlat = lat2 - lat1
             dlon = lon2 - lon1
@@ -267,7 +338,8 @@ class ORToolsPlanner:
     - Single/multi destination constraints
 
     This is a simplified implementation suitable for small to medium instances.
-    For larger problems, consider decomposition or heuristic hybridization.
+    Without multi-destination rakes, the model is decomposed per destination.
+    Each subproblem keeps the small-instance limits.
     """
 
     def __init__(self, config: Dict[str, Any]):
@@ -284,83 +356,148 @@ class ORToolsPlanner:
         self.demurrage_rate = config.get('demurrage_rate', 500)
         self.idle_rate = config.get('idle_cost', 100)
 
+        # CP-SAT parameter overrides, e.g. num_search_workers or max_time_in_seconds
+        self.solver_params = config.get('solver_params', {})
+
     def plan(self, orders: List[Dict], stockyards: List[Dict], rakes: List[Dict]) -> Dict[str, Any]:
         """
         Execute OR-Tools CP-SAT optimization.
         For demo purposes, uses a simplified model.
+        With single-destination rakes the model is split per destination
+        and the smaller models are solved concurrently.
         """
-        model = cp_model.CpModel()
-
         available_rakes = [r for r in rakes if r.get('status') == 'available']
 
-        if len(orders) > 50 or len(available_rakes) > 20:
+        if self.allow_multi_dest:
+            subproblems = [(list(range(len(orders))), list(range(len(available_rakes))))]
+        else:
+            subproblems = self._split_by_destination(orders, available_rakes)
+
+        if any(len(order_idx) > 50 or len(rake_idx) > 20 for order_idx, rake_idx in subproblems):
             fallback = GreedyPlanner(self.config)
             result = fallback.plan(orders, stockyards, rakes)
             result['algorithm'] = 'or-tools (greedy fallback for large instance)'
             return result
 
+        # Concurrent subproblems split the cores rather than each solver using all of them
+        cpus = os.cpu_count() or 1
+        num_workers = max(1, cpus // max(len(subproblems), 1))
+
+        with ThreadPoolExecutor(max_workers=max(min(len(subproblems), cpus), 1)) as pool:
+            solutions = list(pool.map(
+                lambda sp: self._solve_assignment(
+                    [orders[i] for i in sp[0]], [available_rakes[j] for j in sp[1]], num_workers
+                ),
+                subproblems
+            ))
+
+        if any(solution is None for solution in solutions):
+            fallback = GreedyPlanner(self.config)
+            result = fallback.plan(orders, stockyards, rakes)
+            result['algorithm'] = 'or-tools (no solution, greedy fallback)'
+            return result
+
+        orders_by_rake = {}
+        for (order_idx, rake_idx), solution in zip(subproblems, solutions):
+            for j, assigned in solution.items():
+                orders_by_rake[rake_idx[j]] = [orders[order_idx[i]] for i in assigned]
+
+        return self._extract_solution(orders_by_rake, orders, stockyards, available_rakes)
+
+    def _split_by_destination(self, orders: List[Dict], rakes: List[Dict]) -> List[Tuple[List[int], List[int]]]:
+        """
+        Group order indices by destination and share the rakes out between groups.
+        Largest rakes go first, each to the group with the most unserved tonnage.
+        """
+        groups = {}
+        for i, order in enumerate(orders):
+            groups.setdefault(order['destination'], []).append(i)
+
+        unserved = {
+            dest: sum(orders[i]['quantity_tonnes'] for i in order_idx)
+            for dest, order_idx in groups.items()
+        }
+        allocated = {dest: [] for dest in groups}
+
+        for j in sorted(range(len(rakes)), key=lambda j: -rakes[j]['total_capacity_tonnes']):
+            if not unserved:
+                break
+            dest = max(unserved, key=unserved.get)
+            if unserved[dest] <= 0:
+                break
+            allocated[dest].append(j)
+            unserved[dest] -= rakes[j]['total_capacity_tonnes']
+
+        return [(groups[dest], sorted(allocated[dest])) for dest in groups if allocated[dest]]
+
+    def _solve_assignment(self, orders: List[Dict], rakes: List[Dict], num_workers: int = 0) -> Dict[int, List[int]]:
+        """
+        Solve the order to rake assignment model with num_workers search threads
+        (0 lets CP-SAT use every core); solver_params thread settings take precedence.
+        Returns assigned order indices keyed by rake index, or None if no solution was found.
+        """
+        model = cp_model.CpModel()
+
+        # Integer coefficients, quantized once per order rather than per (order, rake) pair
+        weights = [int(order['quantity_tonnes']) for order in orders]
+        costs = [int(order['quantity_tonnes'] * 500) for order in orders]
+
         assignment_vars = {}
         for i, order in enumerate(orders):
-            for j, rake in enumerate(available_rakes):
+            for j, rake in enumerate(rakes):
                 assignment_vars[(i, j)] = model.NewBoolVar(f'assign_o{i}_r{j}')
 
         for i in range(len(orders)):
-            model.Add(sum(assignment_vars[(i, j)] for j in range(len(available_rakes))) <= 1)
+            model.AddAtMostOne(assignment_vars[(i, j)] for j in range(len(rakes)))
 
-        for j, rake in enumerate(available_rakes):
+        for j, rake in enumerate(rakes):
             capacity = int(rake['total_capacity_tonnes'])
             model.Add(
-                sum(
-                    assignment_vars[(i, j)] * int(orders[i]['quantity_tonnes'])
-                    for i in range(len(orders))
+                cp_model.LinearExpr.WeightedSum(
+                    [assignment_vars[(i, j)] for i in range(len(orders))], weights
                 ) <= capacity
             )
 
-        cost_expr = []
-        for i, order in enumerate(orders):
-            for j, rake in enumerate(available_rakes):
-                cost = int(order['quantity_tonnes'] * 500)
-                cost_expr.append(cost * assignment_vars[(i, j)])
-
-        model.Minimize(sum(cost_expr))
+        model.Minimize(cp_model.LinearExpr.WeightedSum(
+            list(assignment_vars.values()),
+            [costs[i] for i, _ in assignment_vars]
+        ))
 
         solver = cp_model.CpSolver()
         solver.parameters.max_time_in_seconds = 30.0
+        if not {'num_workers', 'num_search_workers'} & set(self.solver_params):
+            solver.parameters.num_workers = num_workers
+        for name, value in self.solver_params.items():
+            setattr(solver.parameters, name, value)
         status = solver.Solve(model)
 
-        if status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
-            return self._extract_solution(
-                solver, assignment_vars, orders, stockyards, available_rakes
-            )
-        else:
-            fallback = GreedyPlanner(self.config)
-            result = fallback.plan(orders, stockyards, rakes)
-            result['algorithm'] = 'or-tools (no solution, greedy fallback)'
-            return result
+        if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            return None
+
+        orders_by_rake = {}
+        for (i, j), var in assignment_vars.items():
+            if solver.BooleanValue(var):
+                orders_by_rake.setdefault(j, []).append(i)
+        return orders_by_rake
 
     def _extract_solution(
         self,
-        solver: cp_model.CpSolver,
-        assignment_vars: Dict,
+        orders_by_rake: Dict[int, List[Dict]],
         orders: List[Dict],
         stockyards: List[Dict],
         rakes: List[Dict]
     ) -> Dict[str, Any]:
-        """Extract solution from CP-SAT solver."""
+        """Build plan rakes from the solved orders, keyed by rake index."""
         plan_rakes = []
         assigned_orders = set()
 
-        for j, rake in enumerate(rakes):
-            rake_orders = []
-            total_weight = 0
-
-            for i, order in enumerate(orders):
-                if solver.Value(assignment_vars[(i, j)]) == 1:
-                    rake_orders.append(order)
-                    total_weight += order['quantity_tonnes']
-                    assigned_orders.add(order['id'])
+        for j in sorted(orders_by_rake):
+            rake = rakes[j]
+            rake_orders = orders_by_rake[j]
+            total_weight = sum(o['quantity_tonnes'] for o in rake_orders)
+            assigned_orders.update(o['id'] for o in rake_orders)
 
-            if rake_orders and total_weight >= self.min_rake_size:
+            if total_weight >= self.min_rake_size:
                 destinations = list(set(o['destination'] for o in rake_orders))
 
                 freight_cost = total_weight * 500 * self.freight_rate
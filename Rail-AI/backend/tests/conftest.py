@@ -0,0 +1,21 @@
+import os
+import pytest
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_configure(config):
+    """
+    Point the app at a throwaway SQLite file before any test module imports app.database.
+    The file lives under pytest's basetemp, so old runs are removed by its retention policy.
+    """
+    db_dir = config._tmp_path_factory.mktemp("db")
+    previous = os.environ.get("DATABASE_URL")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_dir / 'test.db'}"
+
+    def restore():
+        if previous is None:
+            os.environ.pop("DATABASE_URL", None)
+        else:
+            os.environ["DATABASE_URL"] = previous
+
+    config.add_cleanup(restore)
@@ -0,0 +1,217 @@
+import asyncio
+import base64
+import csv
+import io
+import uuid
+import pytest
+from datetime import datetime
+from fastapi.testclient import TestClient
+from app.main import app
+from app.models import Stockyard
+from app.routers import data
+
+
+@pytest.fixture(scope="module")
+def client():
+    """App client on the temporary database set up in conftest.py."""
+    with TestClient(app) as client:
+        yield client
+
+
+def upload(client, dataset, content):
+    response = client.post(
+        f"/api/upload/{dataset}",
+        files={"file": (f"{dataset}.csv", content, "text/csv")}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_dataset_cursor_round_trip(client):
+    """Pages chained through next_cursor return every row exactly once."""
+    upload(client, "products", b"code,name\nP1,One\nP2,Two\nP3,Three\n")
+
+    first = client.get("/api/products", params={"limit": 2}).json()
+    assert first["count"] == 2
+    assert first["next_cursor"]
+
+    second = client.get("/api/products", params={"limit": 2, "cursor": first["next_cursor"]}).json()
+    assert second["count"] == 1
+    assert second["next_cursor"] is None
+
+    codes = [row["code"] for row in first["data"] + second["data"]]
+    assert sorted(codes) == ["P1", "P2", "P3"]
+
+
+def test_dataset_invalid_cursor(client):
+    """A cursor that does not decode is rejected with 400."""
+    response = client.get("/api/products", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_cursor_with_invalid_record_id(client):
+    """A cursor whose id part is not a UUID is rejected with 400."""
+    cursor = base64.urlsafe_b64encode(b"2030-01-01T00:00:00|not-a-uuid").decode()
+    response = client.get("/api/products", params={"cursor": cursor})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "method,path",
+    [
+        ("get", "/api/upload/status/missing"),
+        ("get", "/api/job/missing/status"),
+        ("post", "/api/job/missing/cancel"),
+        ("get", "/api/plan/missing"),
+        ("post", "/api/plan/missing/explain"),
+        ("post", "/api/plan/missing/commit"),
+        ("put", "/api/products/missing"),
+        ("delete", "/api/products/missing"),
+    ]
+)
+def test_malformed_ids_are_not_found(client, method, path):
+    """Ids that are not UUIDs never reach the database and return 404."""
+    kwargs = {"json": {"name": "x"}} if method == "put" else {}
+    assert getattr(client, method)(path, **kwargs).status_code == 404
+
+
+def test_upload_keeps_valid_rows(client):
+    """Invalid rows are reported by CSV row number and the valid rows are still ingested."""
+    result = upload(
+        client,
+        "orders",
+        b"order_number,product_code,quantity_tonnes,destination,priority,due_date\n"
+        b"X1,COAL,-5,D,9,2025-01-01\n"
+        b"X2,COAL,10,D,1,2025-01-02\n"
+        b"X3,COAL,10,D,1,notadate\n"
+    )
+
+    assert result["records_created"] == 1
+    assert any(e.startswith("Row 1: quantity_tonnes:") for e in result["errors"])
+    assert any(e.startswith("Row 1: priority:") for e in result["errors"])
+    assert any(e.startswith("Row 3: due_date:") for e in result["errors"])
+
+    order_numbers = {o["order_number"] for o in client.get("/api/orders").json()["data"]}
+    assert "X2" in order_numbers
+    assert not order_numbers & {"X1", "X3"}
+
+
+def test_export_dataset_csv(client):
+    """Exported CSV has one column per table column and the uploaded values."""
+    upload(client, "wagon_types", b"code,name,capacity_tonnes\nBOXN,BOXN Wagon,60\nBCN,BCN Wagon,62.5\n")
+
+    response = client.get("/api/export/wagon_types")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+
+    reader = csv.DictReader(io.StringIO(response.text))
+    assert reader.fieldnames == [
+        "id", "code", "name", "capacity_tonnes", "capacity_volume", "tare_weight", "created_at", "updated_at"
+    ]
+    rows = {row["code"]: row for row in reader}
+    assert set(rows) == {"BOXN", "BCN"}
+    assert float(rows["BCN"]["capacity_tonnes"]) == 62.5
+    assert float(rows["BOXN"]["tare_weight"]) == 20.0
+
+
+def test_upload_job_status(client):
+    """Background uploads report their outcome, including per-row JSON errors."""
+    response = client.post(
+        "/api/upload/stockyards/async",
+        files={"file": (
+            "stockyards.csv",
+            b'code,name,location,latitude,longitude,capacity_tonnes,current_inventory_json\n'
+            b'SY1,One,L,1,1,100,"{""COAL"": 10}"\n'
+            b'SY2,Two,L,1,1,100,{bad\n',
+            "text/csv"
+        )}
+    )
+    assert response.status_code == 200
+    job_id = response.json()["job_id"]
+
+    status = client.get(f"/api/upload/status/{job_id}").json()
+    assert status["status"] == "completed"
+    assert status["progress"] == 100
+    assert status["dataset"] == "stockyards"
+    assert status["records_created"] == 1
+    assert len(status["errors"]) == 1
+    assert status["errors"][0].startswith("Row 2: current_inventory_json: Invalid JSON")
+    assert status["completed_at"] is not None
+
+    assert client.get("/api/upload/status/missing").status_code == 404
+
+
+def test_reupload_updates_rows_across_lookup_batches(client, monkeypatch):
+    """Existing keys are found even when the lookup is split into several queries."""
+    monkeypatch.setattr(data, "LOOKUP_BATCH_SIZE", 2)
+    csv_rows = b"code,name,capacity_tonnes\n" + b"".join(b"W%d,Wagon %d,50\n" % (i, i) for i in range(5))
+    upload(client, "wagon_types", csv_rows)
+    upload(client, "wagon_types", csv_rows.replace(b",50", b",55"))
+
+    rows = [r for r in client.get("/api/wagon_types").json()["data"] if r["code"].startswith("W")]
+    assert len(rows) == 5
+    assert {r["capacity_tonnes"] for r in rows} == {55.0}
+
+
+class StubCopyConnection:
+    """Stands in for the session connection down to asyncpg's copy_records_to_table."""
+
+    def __init__(self):
+        self.driver_connection = self
+        self.calls = []
+
+    async def connection(self):
+        return self
+
+    async def get_raw_connection(self):
+        return self
+
+    async def copy_records_to_table(self, table_name, records, columns):
+        self.calls.append((table_name, records, columns))
+
+
+def test_copy_insert_builds_records():
+    """COPY records follow table column order, fill Python defaults and encode JSON."""
+    stub = StubCopyConnection()
+    rows = [
+        {'code': 'SY1', 'name': 'One', 'location': 'L', 'current_inventory': {'COAL': 10}},
+        {'code': 'SY2', 'name': 'Two', 'location': 'L', 'capacity_tonnes': 5.0},
+    ]
+    asyncio.run(data.copy_insert(stub, Stockyard, rows))
+
+    (table_name, records, columns), = stub.calls
+    assert table_name == 'stockyards'
+    assert columns == [c.name for c in Stockyard.__table__.columns]
+
+    first, second = (dict(zip(columns, record)) for record in records)
+    uuid.UUID(first['id'])
+    assert first['id'] != second['id']
+    assert first['current_inventory'] == '{"COAL":10}'
+    assert second['current_inventory'] == '{}'
+    assert first['capacity_tonnes'] == 100000
+    assert second['capacity_tonnes'] == 5.0
+    assert first['latitude'] is None
+    assert isinstance(first['created_at'], datetime)
+
+
+def test_stockyard_delete_refreshes_dependent_datasets(client):
+    """Cached orders drop a deleted stockyard's id, which ON DELETE SET NULL cleared."""
+    upload(client, "stockyards", b"code,name,location\nSYD,Doomed,L\n")
+    upload(
+        client,
+        "orders",
+        b"order_number,product_code,quantity_tonnes,source_stockyard_code,destination,priority,due_date\n"
+        b"XD1,COAL,10,SYD,D,1,2025-01-02\n"
+    )
+    stockyard_id = next(
+        sy["id"] for sy in client.get("/api/stockyards").json()["data"] if sy["code"] == "SYD"
+    )
+
+    def order_stockyard():
+        orders = client.get("/api/orders").json()["data"]
+        return next(o["source_stockyard_id"] for o in orders if o["order_number"] == "XD1")
+
+    assert order_stockyard() == stockyard_id
+    assert client.delete(f"/api/stockyards/{stockyard_id}").status_code == 200
+    assert order_stockyard() is None
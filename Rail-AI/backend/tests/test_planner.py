@@ -1,9 +1,32 @@
+import csv
+import io
+import json
+import numpy as np
 import pytest
 from app.services.planner import GreedyPlanner, ORToolsPlanner, run_planner
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import MappingProxyType
 
-@pytest.fixture
+BASE_DATE = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+BASE_CONFIG = MappingProxyType({
+    'allow_multi_destination': False,
+    'min_rake_size': 1000,
+    'cost_weights': MappingProxyType({'freight': 1.0, 'demurrage': 0.5, 'idle': 0.3}),
+    'freight_rate': 2.5,
+    'demurrage_rate': 500,
+    'idle_cost': 100
+})
+
+
+def due_epoch(days):
+    return int((BASE_DATE + timedelta(days=days)).timestamp())
+
+
+@pytest.fixture(scope="session")
 def sample_data():
+    """Read-only and shared across the session; tests build patched copies."""
     stockyards = [
         {
             'id': '1',
@@ -13,7 +36,7 @@ def sample_data():
             'latitude': 23.0,
             'longitude': 85.0,
             'capacity_tonnes': 50000,
-            'current_inventory': {'COAL': 30000, 'IRON_ORE': 20000}
+            'current_inventory': MappingProxyType({'COAL': 30000, 'IRON_ORE': 20000})
         },
         {
             'id': '2',
@@ -23,7 +46,7 @@ def sample_data():
             'latitude': 22.0,
             'longitude': 84.0,
             'capacity_tonnes': 40000,
-            'current_inventory': {'COAL': 25000}
+            'current_inventory': MappingProxyType({'COAL': 25000})
         }
     ]
 
@@ -37,7 +60,7 @@ def sample_data():
             'destination_latitude': 19.0,
             'destination_longitude': 72.0,
             'priority': 1,
-            'due_date': datetime.now() + timedelta(days=5),
+            'due_date_epoch': due_epoch(days=5),
             'sla_hours': 72
         },
         {
@@ -49,7 +72,7 @@ def sample_data():
             'destination_latitude': 19.0,
             'destination_longitude': 72.0,
             'priority': 2,
-            'due_date': datetime.now() + timedelta(days=6),
+            'due_date_epoch': due_epoch(days=6),
             'sla_hours': 96
         },
         {
@@ -61,7 +84,7 @@ def sample_data():
             'destination_latitude': 17.0,
             'destination_longitude': 83.0,
             'priority': 1,
-            'due_date': datetime.now() + timedelta(days=4),
+            'due_date_epoch': due_epoch(days=4),
             'sla_hours': 72
         }
     ]
@@ -87,28 +110,53 @@ def sample_data():
         }
     ]
 
-    return {'orders': orders, 'stockyards': stockyards, 'rakes': rakes}
+    return MappingProxyType({
+        'orders': tuple(MappingProxyType(o) for o in orders),
+        'stockyards': tuple(MappingProxyType(sy) for sy in stockyards),
+        'rakes': tuple(MappingProxyType(r) for r in rakes)
+    })
+
+
+@pytest.fixture(scope="session", params=[3, 15, 30], ids=lambda n: f"{n}_orders")
+def sample_data_scaled(request, sample_data):
+    """
+    sample_data repeated up to N orders, with rakes and inventory scaled alike.
+    Sizes stay within ORToolsPlanner's CP-SAT limits (50 orders, 20 rakes).
+    """
+    n = request.param
+    base_orders = sample_data['orders']
+    if n == len(base_orders):
+        return sample_data
+
+    reps = -(-n // len(base_orders))
+    orders = [
+        {**o, 'id': f"{o['id']}-{k}", 'order_number': f"{o['order_number']}-{k}"}
+        for k, o in enumerate(np.repeat(np.array(base_orders, dtype=object), reps)[:n])
+    ]
+    rakes = [
+        {**r, 'id': f"{r['id']}-{k}", 'rake_number': f"{r['rake_number']}-{k}"}
+        for k, r in enumerate(np.repeat(np.array(sample_data['rakes'], dtype=object), reps))
+    ]
+    stockyards = [
+        {**sy, 'current_inventory': {p: qty * reps for p, qty in sy['current_inventory'].items()}}
+        for sy in sample_data['stockyards']
+    ]
 
+    return MappingProxyType({
+        'orders': tuple(MappingProxyType(o) for o in orders),
+        'stockyards': tuple(MappingProxyType(sy) for sy in stockyards),
+        'rakes': tuple(MappingProxyType(r) for r in rakes)
+    })
 
-def test_greedy_planner_packs_orders_correctly(sample_data):
-    """Test that greedy planner correctly packs orders into rakes."""
-    config = {
-        'mode': 'greedy',
-        'allow_multi_destination': False,
-        'min_rake_size': 1000,
-        'cost_weights': {'freight': 1.0, 'demurrage': 0.5, 'idle': 0.3},
-        'freight_rate': 2.5,
-        'demurrage_rate': 500,
-        'idle_cost': 100
-    }
 
-    planner = GreedyPlanner(config)
-    result = planner.plan(
-        sample_data['orders'],
-        sample_data['stockyards'],
-        sample_data['rakes']
-    )
+@pytest.fixture(scope="session")
+def tuned_solver_params():
+    """CP-SAT parameters tuned offline on sample_data (fastest median solve)."""
+    return json.loads((Path(__file__).parent / 'tuned_cpsat_params.json').read_text())
+
 
+def check_packs_orders(result, config, stockyards):
+    """Greedy planner correctly packs orders into rakes."""
     assert result is not None
     assert 'rakes' in result
     assert len(result['rakes']) > 0
@@ -121,16 +169,72 @@ def test_greedy_planner_packs_orders_correctly(sample_data):
         assert len(rake['orders']) > 0
 
 
-def test_ortools_planner_returns_lower_or_equal_cost(sample_data):
-    """Test that OR-Tools planner returns cost <= greedy for small instance."""
+def check_min_rake_size(result, config, stockyards):
+    """Planner respects minimum rake size constraint."""
+    for rake in result['rakes']:
+        assert rake['total_weight'] >= config['min_rake_size']
+
+
+def check_inventory(result, config, stockyards):
+    """Planner doesn't assign orders exceeding inventory."""
+    total_coal_assigned = 0
+    for rake in result['rakes']:
+        for order in rake['orders']:
+            if order['product_code'] == 'COAL':
+                total_coal_assigned += order['quantity']
+
+    total_coal_inventory = sum(
+        sy['current_inventory'].get('COAL', 0)
+        for sy in stockyards
+    )
+
+    assert total_coal_assigned <= total_coal_inventory
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize(
+    "min_rake_size,inventory_patch,check",
+    [
+        pytest.param(1000, None, check_packs_orders, id="packs_orders"),
+        pytest.param(5000, None, check_min_rake_size, id="min_rake_size"),
+        pytest.param(1000, {'COAL': 2000}, check_inventory, id="inventory_constraints"),
+    ]
+)
+def test_greedy_planner(sample_data, min_rake_size, inventory_patch, check):
+    """Test greedy planner constraints; each variant only overrides its deltas."""
+    config = {**BASE_CONFIG, 'mode': 'greedy', 'min_rake_size': min_rake_size}
+
+    stockyards = sample_data['stockyards']
+    if inventory_patch:
+        limited_sy = {
+            **stockyards[0],
+            'current_inventory': {**stockyards[0]['current_inventory'], **inventory_patch}
+        }
+        stockyards = (limited_sy, *stockyards[1:])
+
+    planner = GreedyPlanner(config)
+    result = planner.plan(
+        sample_data['orders'],
+        stockyards,
+        sample_data['rakes']
+    )
+
+    check(result, config, stockyards)
+
+
+@pytest.mark.slow
+def test_ortools_planner_returns_lower_or_equal_cost(sample_data_scaled, tuned_solver_params):
+    """Test that OR-Tools planner returns cost <= greedy at each instance size."""
+    sample_data = sample_data_scaled
     config = {
+        **BASE_CONFIG,
         'mode': 'or-tools',
         'allow_multi_destination': True,
-        'min_rake_size': 1000,
-        'cost_weights': {'freight': 1.0, 'demurrage': 0.5, 'idle': 0.3},
-        'freight_rate': 2.5,
-        'demurrage_rate': 500,
-        'idle_cost': 100
+        'solver_params': {
+            'max_time_in_seconds': 2.0,
+            'relative_gap_limit': 0.05,
+            **tuned_solver_params
+        }
     }
 
     greedy_planner = GreedyPlanner(config)
@@ -147,102 +251,137 @@ def test_ortools_planner_returns_lower_or_equal_cost(sample_data):
         sample_data['rakes']
     )
 
+    assert ortools_result['algorithm'] == 'or-tools (CP-SAT)'
     assert ortools_result['total_cost'] <= greedy_result['total_cost'] * 1.1
 
 
-def test_upload_validation_rejects_malformed_csv():
-    """Test that CSV validation rejects malformed data."""
-    import pandas as pd
-    import io
+@pytest.mark.slow
+def test_ortools_planner_single_destination_rakes(sample_data):
+    """Without multi-destination rakes, each destination group gets its own rakes."""
+    config = {**BASE_CONFIG, 'mode': 'or-tools', 'allow_multi_destination': False}
+    planner = ORToolsPlanner(config)
+    orders = sample_data['orders']
+    rakes = sample_data['rakes']
 
-    malformed_csv = "order_number,product_code\nORD001"
-    df = pd.read_csv(io.StringIO(malformed_csv))
+    subproblems = planner._split_by_destination(orders, rakes)
+    destinations = [{orders[i]['destination'] for i in order_idx} for order_idx, _ in subproblems]
+    assert sorted(d for group in destinations for d in group) == ['Dest 1', 'Dest 2']
+    assert all(len(group) == 1 for group in destinations)
 
-    assert df.shape[0] == 1
-    assert 'product_code' in df.columns
+    allocated = [j for _, rake_idx in subproblems for j in rake_idx]
+    assert all(rake_idx for _, rake_idx in subproblems)
+    assert len(allocated) == len(set(allocated))
 
-    row = df.iloc[0]
-    assert pd.isna(row['product_code'])
+    result = planner.plan(orders, sample_data['stockyards'], rakes)
+    assert result['algorithm'] == 'or-tools (CP-SAT)'
+    for rake in result['rakes']:
+        assert len(rake['destinations']) == 1
+        assert {o['destination'] for o in rake['orders']} == set(rake['destinations'])
 
 
-def test_run_planner_hybrid_mode(sample_data):
-    """Test hybrid mode selects better solution."""
-    config = {
-        'mode': 'hybrid',
-        'allow_multi_destination': True,
-        'min_rake_size': 1000,
-        'cost_weights': {'freight': 1.0, 'demurrage': 0.5, 'idle': 0.3},
-        'freight_rate': 2.5,
-        'demurrage_rate': 500,
-        'idle_cost': 100
-    }
+@pytest.mark.slow
+def test_ortools_planner_shares_cores_between_subproblems(sample_data, monkeypatch):
+    """Each per-destination solve gets its share of the cores unless solver_params sets threads."""
+    from ortools.sat.python import cp_model
 
-    result = run_planner(
-        'hybrid',
-        config,
-        sample_data['orders'],
-        sample_data['stockyards'],
-        sample_data['rakes']
-    )
+    num_workers = []
+    solve = cp_model.CpSolver.Solve
 
-    assert result is not None
-    assert 'hybrid' in result['algorithm'].lower()
-    assert result['total_cost'] > 0
+    def spy(solver, model, *args):
+        num_workers.append(solver.parameters.num_workers)
+        return solve(solver, model, *args)
 
+    monkeypatch.setattr(cp_model.CpSolver, 'Solve', spy)
+    monkeypatch.setattr('os.cpu_count', lambda: 8)
 
-def test_planner_respects_min_rake_size(sample_data):
-    """Test that planner respects minimum rake size constraint."""
-    config = {
-        'mode': 'greedy',
-        'allow_multi_destination': False,
-        'min_rake_size': 5000,
-        'cost_weights': {'freight': 1.0, 'demurrage': 0.5, 'idle': 0.3},
-        'freight_rate': 2.5,
-        'demurrage_rate': 500,
-        'idle_cost': 100
-    }
+    config = {**BASE_CONFIG, 'mode': 'or-tools', 'allow_multi_destination': False}
+    args = (sample_data['orders'], sample_data['stockyards'], sample_data['rakes'])
 
-    planner = GreedyPlanner(config)
-    result = planner.plan(
-        sample_data['orders'],
+    ORToolsPlanner(config).plan(*args)
+    assert num_workers == [4, 4]
+
+    num_workers.clear()
+    ORToolsPlanner({**config, 'solver_params': {'num_workers': 1}}).plan(*args)
+    assert num_workers == [1, 1]
+
+
+@pytest.mark.slow
+def test_greedy_planner_orders_by_due_date(sample_data):
+    """Orders carrying only due_date (aware, naive or missing) sort like due_date_epoch."""
+    orders = [
+        {k: v for k, v in o.items() if k != 'due_date_epoch'}
+        for o in sample_data['orders']
+    ]
+    orders[0]['due_date'] = None
+    orders[1]['due_date'] = BASE_DATE + timedelta(days=6)
+    orders[2]['due_date'] = (BASE_DATE + timedelta(days=4)).replace(tzinfo=None)
+
+    sorted_orders = sorted(orders, key=GreedyPlanner._order_sort_key)
+    assert [o['id'] for o in sorted_orders] == ['o3', 'o1', 'o2']
+
+    for o in orders:
+        o['priority'] = 1
+    sorted_orders = sorted(orders, key=GreedyPlanner._order_sort_key)
+    assert [o['id'] for o in sorted_orders] == ['o3', 'o2', 'o1']
+
+    result = GreedyPlanner({**BASE_CONFIG, 'mode': 'greedy'}).plan(
+        orders,
         sample_data['stockyards'],
         sample_data['rakes']
     )
+    assert result['total_orders'] == len(orders)
+    assert result['orders_fulfilled'] > 0
 
-    for rake in result['rakes']:
-        assert rake['total_weight'] >= config['min_rake_size']
 
+def test_upload_validation_rejects_malformed_csv():
+    """Test that CSV validation rejects malformed data."""
+    malformed_csv = "order_number,product_code\nORD001"
+    header, *rows = csv.reader(io.StringIO(malformed_csv))
 
-def test_planner_respects_inventory_constraints(sample_data):
-    """Test that planner doesn't assign orders exceeding inventory."""
-    sample_data['stockyards'][0]['current_inventory']['COAL'] = 2000
+    assert len(rows) == 1
+    assert 'product_code' in header
 
-    config = {
-        'mode': 'greedy',
-        'allow_multi_destination': False,
-        'min_rake_size': 1000,
-        'cost_weights': {'freight': 1.0, 'demurrage': 0.5, 'idle': 0.3},
-        'freight_rate': 2.5,
-        'demurrage_rate': 500,
-        'idle_cost': 100
-    }
+    row = rows[0]
+    assert len(row) < len(header)
 
-    planner = GreedyPlanner(config)
-    result = planner.plan(
+
+@pytest.mark.slow
+def test_run_planner_hybrid_mode(sample_data):
+    """Test hybrid mode selects better solution."""
+    config = {**BASE_CONFIG, 'mode': 'hybrid', 'allow_multi_destination': True}
+
+    result = run_planner(
+        'hybrid',
+        config,
         sample_data['orders'],
         sample_data['stockyards'],
         sample_data['rakes']
     )
 
-    total_coal_assigned = 0
-    for rake in result['rakes']:
-        for order in rake['orders']:
-            if order['product_code'] == 'COAL':
-                total_coal_assigned += order['quantity']
+    assert result is not None
+    assert 'hybrid' in result['algorithm'].lower()
+    assert result['total_cost'] > 0
 
-    total_coal_inventory = sum(
-        sy['current_inventory'].get('COAL', 0)
-        for sy in sample_data['stockyards']
+
+@pytest.mark.slow
+@pytest.mark.benchmark
+@pytest.mark.parametrize(
+    "planner_cls,mode",
+    [(GreedyPlanner, 'greedy'), (ORToolsPlanner, 'or-tools')],
+    ids=["greedy", "or-tools"]
+)
+def test_planner_benchmark(sample_data, benchmark, planner_cls, mode):
+    """Record planner wall time; compare runs with --benchmark-compare."""
+    config = {**BASE_CONFIG, 'mode': mode}
+
+    result = benchmark.pedantic(
+        lambda: planner_cls(config).plan(
+            sample_data['orders'],
+            sample_data['stockyards'],
+            sample_data['rakes']
+        ),
+        rounds=3,
+        warmup_rounds=1
     )
 
-    assert total_coal_assigned <= total_coal_inventory
+    assert result['total_orders'] == len(sample_data['orders'])
@@ -11,6 +11,7 @@ interface CSVUploaderProps {
 export default function CSVUploader({ dataset, onUploadComplete }: CSVUploaderProps) {
   const [file, setFile] = useState<File | null>(null);
   const [uploading, setUploading] = useState(false);
+  const [progress, setProgress] = useState(0);
   const [error, setError] = useState<string | null>(null);
   const [dragActive, setDragActive] = useState(false);
 
@@ -56,11 +57,24 @@ export default function CSVUploader({ dataset, onUploadComplete }: CSVUploaderPr
     if (!file) return;
 
     setUploading(true);
+    setProgress(0);
     setError(null);
 
     try {
-      const result = await api.uploadDataset(dataset, file);
-      alert(`Successfully uploaded ${result.records_created} records`);
+      const { job_id } = await api.uploadDatasetAsync(dataset, file);
+      let job = await api.getUploadStatus(job_id);
+      while (job.status === 'queued' || job.status === 'running') {
+        setProgress(job.progress);
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        job = await api.getUploadStatus(job_id);
+      }
+
+      if (job.status === 'failed') {
+        throw new Error(job.errors[0] || 'Upload failed');
+      }
+
+      const skipped = job.errors.length ? `\n\nSkipped rows:\n${job.errors.join('\n')}` : '';
+      alert(`Successfully uploaded ${job.records_created} records${skipped}`);
       setFile(null);
       onUploadComplete();
     } catch (err: any) {
@@ -146,7 +160,7 @@ export default function CSVUploader({ dataset, onUploadComplete }: CSVUploaderPr
           disabled={uploading}
           className="w-full inline-flex justify-center items-center px-4 py-2 border border-transparent text-sm font-medium rounded-md text-white bg-blue-600 hover:bg-blue-700 disabled:opacity-50"
         >
-          {uploading ? 'Uploading...' : 'Upload to Server'}
+          {uploading ? `Uploading... ${Math.round(progress)}%` : 'Upload to Server'}
         </button>
       )}
     </div>
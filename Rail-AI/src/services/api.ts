@@ -1,4 +1,4 @@
-import type { DatasetType, PlanningJob, Plan } from '../types';
+import type { DatasetType, PlanningJob, Plan, UploadJob } from '../types';
 
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
@@ -9,11 +9,11 @@ export const api = {
     return response.blob();
   },
 
-  async uploadDataset(dataset: DatasetType, file: File): Promise<any> {
+  async uploadDatasetAsync(dataset: DatasetType, file: File): Promise<{ job_id: string }> {
     const formData = new FormData();
     formData.append('file', file);
 
-    const response = await fetch(`${API_BASE_URL}/api/upload/${dataset}`, {
+    const response = await fetch(`${API_BASE_URL}/api/upload/${dataset}/async`, {
       method: 'POST',
       body: formData,
     });
@@ -26,6 +26,12 @@ export const api = {
     return response.json();
   },
 
+  async getUploadStatus(jobId: string): Promise<UploadJob> {
+    const response = await fetch(`${API_BASE_URL}/api/upload/status/${jobId}`);
+    if (!response.ok) throw new Error('Failed to fetch upload status');
+    return response.json();
+  },
+
   async getDataset(dataset: DatasetType, skip = 0, limit = 1000): Promise<any> {
     const response = await fetch(
       `${API_BASE_URL}/api/${dataset}?skip=${skip}&limit=${limit}`
@@ -90,6 +90,18 @@ export interface Stockyard {
     plan_id?: string;
   }
   
+  export interface UploadJob {
+    job_id: string;
+    dataset: DatasetType;
+    filename: string;
+    status: 'queued' | 'running' | 'completed' | 'failed';
+    progress: number;
+    records_created: number;
+    errors: string[];
+    started_at?: string;
+    completed_at?: string;
+  }
+  
   export interface Plan {
     id: string;
     job_id: string;